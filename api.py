@@ -1,13 +1,18 @@
 """FastAPI application exposing RuneScape player-count data."""
 
+import time
 from datetime import datetime, timedelta
-from typing import Optional
+from functools import partial
+from typing import Callable, Optional
 
+import orjson
 from fastapi import Depends, FastAPI, Query
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 from pydantic import BaseModel
-from sqlalchemy.orm import Session
+from sqlalchemy.engine import Result
+from sqlalchemy.orm import Session, sessionmaker
 
-from models import get_engine, get_session, init_db
+from models import get_engine, init_db
 from queries import (
     Aggregation,
     Granularity,
@@ -25,9 +30,13 @@ app = FastAPI(title="RuneScape Player Count API")
 engine = get_engine()
 init_db(engine)
 
+#Built once; the endpoints are read-only, so autoflush and expire-on-commit
+#only cost extra work per request.
+SessionLocal = sessionmaker(bind=engine, autoflush=False, expire_on_commit=False)
+
 
 def get_db():
-    session = get_session(engine)
+    session = SessionLocal()
     try:
         yield session
     finally:
@@ -72,154 +81,281 @@ class ActivityEntry(BaseModel):
 
 
 # ---------------------------------------------------------------------------
-# Default date helpers
+# Response class
 # ---------------------------------------------------------------------------
 
 
-def _default_start() -> datetime:
-    return datetime.now() - timedelta(hours=24)
+#Stored timestamps are naive local time, so OPT_NAIVE_UTC is deliberately
+#not set: it would label them as UTC.
+_ORJSON_OPTIONS = orjson.OPT_SERIALIZE_NUMPY
+
+
+def _dumps(content) -> bytes:
+    """Serialize *content* with orjson, encoding datetimes natively."""
+    return orjson.dumps(content, default=str, option=_ORJSON_OPTIONS)
+
+
+class ORJSONResponse(JSONResponse):
+    """JSON response rendered with orjson.
 
+    Endpoints return this directly so FastAPI skips ``jsonable_encoder`` and
+    response-model validation; the schemas above are kept for the docs only.
+    """
+
+    def render(self, content) -> bytes:
+        return _dumps(content)
+
+
+# ---------------------------------------------------------------------------
+# Time-series responses
+# ---------------------------------------------------------------------------
 
-def _default_end() -> datetime:
+#(ttl, key snap) in seconds per granularity.  When start/end are omitted the
+#default window is snapped in the cache key so repeated dashboard loads share
+#an entry; explicit bounds are keyed exactly.  Sub-hourly series are not
+#cached; they are streamed instead.
+_CACHE_POLICY = {
+    Granularity.HOURLY: (300, 3600),
+    Granularity.DAILY: (3600, 86400),
+    Granularity.WEEKLY: (3600, 86400),
+    Granularity.MONTHLY: (3600, 86400),
+}
+_CACHE_MAX_ENTRIES = 1024
+
+#Rows fetched from the database and encoded per streamed chunk.
+_STREAM_BATCH_SIZE = 1000
+
+#Cache key -> (expires_at, rendered JSON body).
+_response_cache: dict[tuple, tuple[float, bytes]] = {}
+
+
+def _records(result: Result) -> list[dict]:
+    """Convert *result* to a list of dicts keyed by column label.
+
+    Rows are unpacked positionally, avoiding per-key ``Row`` attribute and
+    mapping lookups.
+    """
+    keys = tuple(result.keys())
+    return [dict(zip(keys, row)) for row in result.tuples()]
+
+
+def _stream_json(result: Result) -> StreamingResponse:
+    """Stream *result* as a JSON array, one ``yield_per`` partition at a time.
+
+    Peak memory is bounded by the batch size rather than the result size.
+    """
+    keys = tuple(result.keys())
+
+    def chunks():
+        separator = b""
+        yield b"["
+        for batch in result.tuples().partitions():
+            # Strip the enclosing brackets so batches join into one array.
+            yield separator + _dumps([dict(zip(keys, row)) for row in batch])[1:-1]
+            separator = b","
+        yield b"]"
+
+    return StreamingResponse(chunks(), media_type="application/json")
+
+
+def _cache_bound(value: Optional[datetime], default: datetime, snap: int):
+    """Cache-key form of a range bound.
+
+    Explicit bounds are used as-is, since the query runs on exactly that
+    range.  Defaulted bounds follow the clock, so they are snapped to *snap*
+    seconds; a cached body then lags the sliding default window by at most
+    the TTL.
+    """
+    if value is not None:
+        return value
+    return int(default.timestamp()) // snap
+
+
+def _timeseries_response(
+    key: tuple,
+    granularity: Granularity,
+    start: Optional[datetime],
+    end: Optional[datetime],
+    window: tuple[datetime, datetime],
+    run: Callable[..., Result],
+) -> Response:
+    """Return the cached JSON body for *key*, or call *run* and respond.
+
+    *start*/*end* are the bounds as requested (``None`` when omitted) and
+    *window* the defaults substituted for them.  *run* executes the query
+    and is only called on a cache miss.  Granularities without a cache
+    policy are streamed uncached.
+    """
+    policy = _CACHE_POLICY.get(granularity)
+    if policy is None:
+        return _stream_json(run(yield_per=_STREAM_BATCH_SIZE))
+
+    ttl, snap = policy
+    key = (
+        *key,
+        granularity,
+        _cache_bound(start, window[0], snap),
+        _cache_bound(end, window[1], snap),
+    )
+    now = time.monotonic()
+    hit = _response_cache.get(key)
+    if hit is not None and hit[0] > now:
+        return Response(hit[1], media_type="application/json")
+
+    response = ORJSONResponse(_records(run()))
+    if len(_response_cache) >= _CACHE_MAX_ENTRIES:
+        # Snapshot the items: other threadpool requests may insert meanwhile.
+        for k, (expires, _) in list(_response_cache.items()):
+            if expires <= now:
+                _response_cache.pop(k, None)
+        if len(_response_cache) >= _CACHE_MAX_ENTRIES:
+            _response_cache.clear()
+    _response_cache[key] = (now + ttl, response.body)
+    return response
+
+
+# ---------------------------------------------------------------------------
+# Default date helpers
+# ---------------------------------------------------------------------------
+
+
+def _now() -> datetime:
     return datetime.now()
 
 
+def _default_window(now: datetime = Depends(_now)) -> tuple[datetime, datetime]:
+    """Default ``(start, end)``: the last 24 hours, from one clock read."""
+    return now - timedelta(hours=24), now
+
+
 # ---------------------------------------------------------------------------
 # Endpoints
 # ---------------------------------------------------------------------------
 
 
-@app.get("/api/player-count", response_model=list[TimeSeriesPoint])
+@app.get("/api/player-count", responses={200: {"model": list[TimeSeriesPoint]}})
 def get_player_count(
     game: str = Query("OSRS", description="Game: OSRS or RS3"),
     start: Optional[datetime] = Query(None),
     end: Optional[datetime] = Query(None),
     granularity: Granularity = Query(Granularity.HOURLY),
     agg: Aggregation = Query(Aggregation.AVERAGE),
+    window: tuple[datetime, datetime] = Depends(_default_window),
     db: Session = Depends(get_db),
 ):
-    rows = player_count_timeseries(
+    run = partial(
+        player_count_timeseries,
         db,
         game=game,
-        start=start or _default_start(),
-        end=end or _default_end(),
+        start=start or window[0],
+        end=end or window[1],
         granularity=granularity,
         agg=agg,
     )
-    return [{"time_bucket": r.time_bucket, "player_count": r.player_count} for r in rows]
+    return _timeseries_response(("player-count", game, agg), granularity, start, end, window, run)
 
 
-@app.get("/api/player-count/combined", response_model=list[TimeSeriesPoint])
+@app.get("/api/player-count/combined", responses={200: {"model": list[TimeSeriesPoint]}})
 def get_combined_total(
     start: Optional[datetime] = Query(None),
     end: Optional[datetime] = Query(None),
     granularity: Granularity = Query(Granularity.HOURLY),
     agg: Aggregation = Query(Aggregation.AVERAGE),
+    window: tuple[datetime, datetime] = Depends(_default_window),
     db: Session = Depends(get_db),
 ):
-    rows = combined_total_timeseries(
+    run = partial(
+        combined_total_timeseries,
         db,
-        start=start or _default_start(),
-        end=end or _default_end(),
+        start=start or window[0],
+        end=end or window[1],
         granularity=granularity,
         agg=agg,
     )
-    return [{"time_bucket": r.time_bucket, "player_count": r.player_count} for r in rows]
+    return _timeseries_response(("combined", agg), granularity, start, end, window, run)
 
 
-@app.get("/api/player-count/by-type", response_model=list[TypedTimeSeriesPoint])
+@app.get("/api/player-count/by-type", responses={200: {"model": list[TypedTimeSeriesPoint]}})
 def get_by_type(
     start: Optional[datetime] = Query(None),
     end: Optional[datetime] = Query(None),
     granularity: Granularity = Query(Granularity.HOURLY),
     agg: Aggregation = Query(Aggregation.AVERAGE),
+    window: tuple[datetime, datetime] = Depends(_default_window),
     db: Session = Depends(get_db),
 ):
-    rows = player_count_by_type(
+    run = partial(
+        player_count_by_type,
         db,
-        start=start or _default_start(),
-        end=end or _default_end(),
+        start=start or window[0],
+        end=end or window[1],
         granularity=granularity,
         agg=agg,
     )
-    return [
-        {"time_bucket": r.time_bucket, "player_type": r.player_type, "player_count": r.player_count}
-        for r in rows
-    ]
+    return _timeseries_response(("by-type", agg), granularity, start, end, window, run)
 
 
-@app.get("/api/player-count/by-region", response_model=list[RegionTimeSeriesPoint])
+@app.get("/api/player-count/by-region", responses={200: {"model": list[RegionTimeSeriesPoint]}})
 def get_by_region(
     start: Optional[datetime] = Query(None),
     end: Optional[datetime] = Query(None),
     granularity: Granularity = Query(Granularity.HOURLY),
     agg: Aggregation = Query(Aggregation.AVERAGE),
+    window: tuple[datetime, datetime] = Depends(_default_window),
     db: Session = Depends(get_db),
 ):
-    rows = player_count_by_region(
+    run = partial(
+        player_count_by_region,
         db,
-        start=start or _default_start(),
-        end=end or _default_end(),
+        start=start or window[0],
+        end=end or window[1],
         granularity=granularity,
         agg=agg,
     )
-    return [
-        {"time_bucket": r.time_bucket, "region": r.region, "player_count": r.player_count}
-        for r in rows
-    ]
+    return _timeseries_response(("by-region", agg), granularity, start, end, window, run)
 
 
-@app.get("/api/player-count/by-world/{world}", response_model=list[TimeSeriesPoint])
+@app.get("/api/player-count/by-world/{world}", responses={200: {"model": list[TimeSeriesPoint]}})
 def get_by_world(
     world: str,
     start: Optional[datetime] = Query(None),
     end: Optional[datetime] = Query(None),
     granularity: Granularity = Query(Granularity.HOURLY),
     agg: Aggregation = Query(Aggregation.AVERAGE),
+    window: tuple[datetime, datetime] = Depends(_default_window),
     db: Session = Depends(get_db),
 ):
-    rows = player_count_by_world(
+    run = partial(
+        player_count_by_world,
         db,
         world=world,
-        start=start or _default_start(),
-        end=end or _default_end(),
+        start=start or window[0],
+        end=end or window[1],
         granularity=granularity,
         agg=agg,
     )
-    return [{"time_bucket": r.time_bucket, "player_count": r.player_count} for r in rows]
+    return _timeseries_response(("by-world", world, agg), granularity, start, end, window, run)
 
 
-@app.get("/api/player-count/by-activity", response_model=list[ActivityEntry])
+@app.get("/api/player-count/by-activity", responses={200: {"model": list[ActivityEntry]}})
 def get_by_activity(
     start: Optional[datetime] = Query(None),
     end: Optional[datetime] = Query(None),
+    window: tuple[datetime, datetime] = Depends(_default_window),
     db: Session = Depends(get_db),
 ):
     rows = player_count_by_activity(
         db,
-        start=start or _default_start(),
-        end=end or _default_end(),
+        start=start or window[0],
+        end=end or window[1],
     )
-    return [
-        {"activity": r.activity, "total_players": r.total_players, "snapshot_count": r.snapshot_count}
-        for r in rows
-    ]
+    return ORJSONResponse(_records(rows))
 
 
-@app.get("/api/worlds/snapshot", response_model=list[WorldSnapshotEntry])
+@app.get("/api/worlds/snapshot", responses={200: {"model": list[WorldSnapshotEntry]}})
 def get_world_snapshot(
     timestamp: Optional[datetime] = Query(None),
     db: Session = Depends(get_db),
 ):
     rows = world_snapshot(db, timestamp=timestamp)
-    return [
-        {
-            "world": r.world,
-            "players": r.players,
-            "location": r.location,
-            "type": r.type,
-            "activity": r.activity,
-            "timestamp": r.timestamp,
-        }
-        for r in rows
-    ]
+    return ORJSONResponse(_records(rows))
@@ -6,13 +6,50 @@ Defines two tables:
 * **playercountbyworld** -- per-world population snapshots for OSRS.
 """
 
+import calendar
+from contextlib import contextmanager
 from datetime import datetime
 
-from sqlalchemy import Column, DateTime, Index, Integer, String, create_engine
+from sqlalchemy import (
+    Column,
+    DateTime,
+    Index,
+    Integer,
+    String,
+    create_engine,
+    event,
+    inspect,
+    text,
+)
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import OperationalError
 from sqlalchemy.orm import declarative_base, sessionmaker
 
 Base = declarative_base()
 
+#Width in seconds of the precomputed ``bucket_5min`` time bucket.
+BUCKET_SECONDS = 300
+
+
+def five_minute_bucket(timestamp):
+    """Return the 5-minute bucket number stored in ``bucket_5min``.
+
+    Timestamps are naive, so they are treated as UTC here.  This matches
+    SQLite's ``strftime('%s', ...)`` on the stored value and lets the bucket
+    be formatted back with the ``'unixepoch'`` modifier unchanged.
+    """
+    return calendar.timegm(timestamp.timetuple()) // BUCKET_SECONDS
+
+
+def _bucket_default(context):
+    """Column default deriving ``bucket_5min`` from the row's ``timestamp``.
+
+    ``timestamp`` precedes ``bucket_5min``, so its own default has already
+    been applied when this runs.
+    """
+    timestamp = context.get_current_parameters().get("timestamp")
+    return five_minute_bucket(timestamp) if timestamp is not None else None
+
 
 class PlayerCount(Base):
     """A single total-player-count observation for one game."""
@@ -23,6 +60,7 @@ class PlayerCount(Base):
     player_count = Column(Integer, nullable=False)
     game = Column(String, nullable=False)
     timestamp = Column(DateTime, default=datetime.now)
+    bucket_5min = Column(Integer, default=_bucket_default, index=True)
 
     __table_args__ = (
         Index("ix_playercount_game_timestamp", "game", "timestamp"),
@@ -48,6 +86,7 @@ class PlayerCountByWorld(Base):
     type = Column(String)
     activity = Column(String)
     timestamp = Column(DateTime, default=datetime.now)
+    bucket_5min = Column(Integer, default=_bucket_default, index=True)
 
     __table_args__ = (
         Index("ix_playercountbyworld_timestamp", "timestamp"),
@@ -61,18 +100,97 @@ class PlayerCountByWorld(Base):
         )
 
 
+#Applied to every new SQLite connection.  WAL lets API readers proceed while
+#the scraper writes, and synchronous=NORMAL is durable enough under WAL.
+_SQLITE_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA mmap_size=268435456",
+    "PRAGMA cache_size=-65536",
+)
+
+
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    for pragma in _SQLITE_PRAGMAS:
+        cursor.execute(pragma)
+    cursor.close()
+
+
 def get_engine(db_url="sqlite:///runescape_stats.db"):
     """Create and return a SQLAlchemy engine.
 
+    SQLite engines allow connections to be shared across threads, so the
+    FastAPI threadpool can reuse pooled connections, and get the pragmas in
+    ``_SQLITE_PRAGMAS`` set on connect.
+
     Args:
         db_url: Database connection string. Defaults to a local SQLite file.
     """
-    return create_engine(db_url)
+    if make_url(db_url).get_backend_name() != "sqlite":
+        return create_engine(db_url, pool_pre_ping=True)
+
+    engine = create_engine(db_url, connect_args={"check_same_thread": False})
+    event.listen(engine, "connect", _set_sqlite_pragmas)
+    return engine
+
+
+@contextmanager
+def _tolerate_concurrent_ddl(message):
+    """Ignore a DDL error containing *message*.
+
+    Several API workers run :func:`init_db` at startup; when two race to
+    create the same table, index or column, the loser's statement fails
+    but the schema object exists, which is all that is needed.
+    """
+    try:
+        yield
+    except OperationalError as exc:
+        if message not in str(exc.orig):
+            raise
 
 
 def init_db(engine):
-    """Create all tables that do not yet exist."""
-    Base.metadata.create_all(engine)
+    """Create all tables, columns and indexes that do not yet exist.
+
+    ``create_all`` skips tables that are already present, including their
+    indexes, so databases created before an index was declared would never
+    get it.  Tables and indexes are therefore created individually, and
+    tolerate another process having created them first.
+    """
+    for table in Base.metadata.sorted_tables:
+        with _tolerate_concurrent_ddl("already exists"):
+            table.create(engine, checkfirst=True)
+    _add_bucket_columns(engine)
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            with _tolerate_concurrent_ddl("already exists"):
+                index.create(engine, checkfirst=True)
+
+
+def _add_bucket_columns(engine):
+    """Add and backfill ``bucket_5min`` on tables created before it existed.
+
+    The backfill only touches NULL buckets, so it is idempotent and safe to
+    run from every worker.
+    """
+    for table in (PlayerCount.__tablename__, PlayerCountByWorld.__tablename__):
+        columns = {col["name"] for col in inspect(engine).get_columns(table)}
+        if "bucket_5min" not in columns:
+            with _tolerate_concurrent_ddl("duplicate column name"):
+                with engine.begin() as conn:
+                    conn.execute(
+                        text(f"ALTER TABLE {table} ADD COLUMN bucket_5min INTEGER")
+                    )
+        with engine.begin() as conn:
+            conn.execute(
+                text(
+                    f"UPDATE {table} SET bucket_5min = "
+                    f"CAST(strftime('%s', timestamp) AS INTEGER) / {BUCKET_SECONDS} "
+                    "WHERE bucket_5min IS NULL"
+                )
+            )
 
 
 def get_session(engine):
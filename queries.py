@@ -1,16 +1,18 @@
 """Reusable query functions for RuneScape player-count data.
 
 All time-series queries support variable granularity (time bucketing)
-and aggregation (average vs peak).
+and aggregation (average vs peak).  Every function returns a SQLAlchemy
+``Result``; the time-series ones accept ``yield_per`` to stream large results
+instead of buffering them.
 """
 
 from datetime import datetime
 from enum import Enum
 
-from sqlalchemy import Integer as SAInteger, func
+from sqlalchemy import bindparam, func, select
 from sqlalchemy.orm import Session
 
-from models import PlayerCount, PlayerCountByWorld
+from models import BUCKET_SECONDS, PlayerCount, PlayerCountByWorld
 
 
 class Granularity(str, Enum):
@@ -28,11 +30,22 @@ class Aggregation(str, Enum):
     PEAK = "peak"
 
 
-# SQLite strftime patterns for time bucketing
+# Fixed-width granularities, as a multiple of the stored 5-minute bucket.
+# These group on integer division of ``bucket_5min``; calendar-based
+# granularities (weekly, monthly) still group on a strftime of the timestamp.
+_BUCKET_WIDTH = {
+    Granularity.FIVE_MIN: 1,
+    Granularity.FIFTEEN_MIN: 3,
+    Granularity.THIRTY_MIN: 6,
+    Granularity.HOURLY: 12,
+    Granularity.DAILY: 288,
+}
+
+# SQLite strftime patterns for the returned ``time_bucket`` label
 _BUCKET_FORMAT = {
-    Granularity.FIVE_MIN: None,  # handled specially
-    Granularity.FIFTEEN_MIN: None,  # handled specially
-    Granularity.THIRTY_MIN: None,  # handled specially
+    Granularity.FIVE_MIN: "%Y-%m-%d %H:%M:00",
+    Granularity.FIFTEEN_MIN: "%Y-%m-%d %H:%M:00",
+    Granularity.THIRTY_MIN: "%Y-%m-%d %H:%M:00",
     Granularity.HOURLY: "%Y-%m-%d %H:00:00",
     Granularity.DAILY: "%Y-%m-%d",
     Granularity.WEEKLY: "%Y-%W",
@@ -40,30 +53,197 @@ _BUCKET_FORMAT = {
 }
 
 
-def _time_bucket(timestamp_col, granularity: Granularity):
-    """Return a SQL expression that truncates *timestamp_col* to the bucket."""
+def _build_time_bucket(model, granularity: Granularity):
+    """Return ``(bucket, label)`` SQL expressions for rows of *model*.
+
+    *bucket* is what to group and order by; *label* is the formatted
+    ``time_bucket`` string, computed once per group rather than per row.
+    """
     fmt = _BUCKET_FORMAT[granularity]
-    if fmt is not None:
-        return func.strftime(fmt, timestamp_col)
-
-    # Sub-hourly: truncate minutes to nearest N-minute boundary
-    minutes = {
-        Granularity.FIVE_MIN: 5,
-        Granularity.FIFTEEN_MIN: 15,
-        Granularity.THIRTY_MIN: 30,
-    }[granularity]
-
-    return func.strftime(
-        "%Y-%m-%d %H:",
-        timestamp_col,
-    ) + func.printf(
-        "%02d:00",
-        (func.cast(func.strftime("%M", timestamp_col), SAInteger) / minutes) * minutes,
-    )
+    width = _BUCKET_WIDTH.get(granularity)
+    if width is None:
+        bucket = func.strftime(fmt, model.timestamp)
+        return bucket, bucket
+
+    bucket = model.bucket_5min // width
+    label = func.strftime(fmt, bucket * (width * BUCKET_SECONDS), "unixepoch")
+    return bucket, label
+
+
+# Bucket expressions are immutable, so build each one once at import time
+# instead of on every request.
+_TIME_BUCKETS = {
+    (model, granularity): _build_time_bucket(model, granularity)
+    for model in (PlayerCount, PlayerCountByWorld)
+    for granularity in Granularity
+}
+
+_AGG_FUNCS = {
+    Aggregation.AVERAGE: func.avg,
+    Aggregation.PEAK: func.max,
+}
+
+
+def _time_bucket(model, granularity: Granularity):
+    return _TIME_BUCKETS[model, granularity]
 
 
 def _agg_func(agg: Aggregation):
-    return func.avg if agg == Aggregation.AVERAGE else func.max
+    return _AGG_FUNCS[agg]
+
+
+def _execute(session: Session, stmt, params: dict, yield_per: int | None = None):
+    """Execute *stmt*, fetching ``yield_per`` rows at a time when given."""
+    if yield_per is None:
+        return session.execute(stmt, params)
+    return session.execute(stmt, params, execution_options={"yield_per": yield_per})
+
+
+# ---------------------------------------------------------------------------
+# Prebuilt statements
+# ---------------------------------------------------------------------------
+#
+# Every statement is built once at import time with bound parameters
+# (``:start``, ``:end``, ``:game``, ``:world``, ``:timestamp``), so requests only
+# supply values instead of constructing a new expression tree.  SQLAlchemy
+# still computes the statement's cache key on each execute and looks up the
+# compiled SQL in its statement cache.
+
+
+def _game_timeseries_stmt(granularity: Granularity, agg: Aggregation):
+    bucket, label = _time_bucket(PlayerCount, granularity)
+    return (
+        select(
+            label.label("time_bucket"),
+            _agg_func(agg)(PlayerCount.player_count).label("player_count"),
+        )
+        .filter(
+            PlayerCount.game == bindparam("game"),
+            PlayerCount.timestamp >= bindparam("start"),
+            PlayerCount.timestamp <= bindparam("end"),
+        )
+        .group_by(bucket)
+        .order_by(bucket)
+    )
+
+
+def _combined_timeseries_stmt(granularity: Granularity, agg: Aggregation):
+    bucket, label = _time_bucket(PlayerCount, granularity)
+    return (
+        select(
+            label.label("time_bucket"),
+            _agg_func(agg)(PlayerCount.player_count).label("player_count"),
+        )
+        .filter(
+            PlayerCount.timestamp >= bindparam("start"),
+            PlayerCount.timestamp <= bindparam("end"),
+        )
+        .group_by(bucket)
+        .order_by(bucket)
+    )
+
+
+def _world_column_timeseries_stmt(granularity: Granularity, column, label_name: str):
+    bucket, label = _time_bucket(PlayerCountByWorld, granularity)
+    return (
+        select(
+            label.label("time_bucket"),
+            column.label(label_name),
+            func.sum(PlayerCountByWorld.players).label("player_count"),
+        )
+        .filter(
+            PlayerCountByWorld.timestamp >= bindparam("start"),
+            PlayerCountByWorld.timestamp <= bindparam("end"),
+        )
+        .group_by(bucket, column)
+        .order_by(bucket)
+    )
+
+
+def _world_timeseries_stmt(granularity: Granularity, agg: Aggregation):
+    bucket, label = _time_bucket(PlayerCountByWorld, granularity)
+    return (
+        select(
+            label.label("time_bucket"),
+            _agg_func(agg)(PlayerCountByWorld.players).label("player_count"),
+        )
+        .filter(
+            PlayerCountByWorld.world == bindparam("world"),
+            PlayerCountByWorld.timestamp >= bindparam("start"),
+            PlayerCountByWorld.timestamp <= bindparam("end"),
+        )
+        .group_by(bucket)
+        .order_by(bucket)
+    )
+
+
+def _snapshot_stmt(timestamp):
+    return (
+        select(
+            PlayerCountByWorld.world,
+            PlayerCountByWorld.players,
+            PlayerCountByWorld.location,
+            PlayerCountByWorld.type,
+            PlayerCountByWorld.activity,
+            PlayerCountByWorld.timestamp,
+        )
+        .filter(PlayerCountByWorld.timestamp == timestamp)
+        .order_by(PlayerCountByWorld.players.desc())
+    )
+
+
+_GAME_TIMESERIES = {
+    (granularity, agg): _game_timeseries_stmt(granularity, agg)
+    for granularity in Granularity
+    for agg in Aggregation
+}
+_COMBINED_TIMESERIES = {
+    (granularity, agg): _combined_timeseries_stmt(granularity, agg)
+    for granularity in Granularity
+    for agg in Aggregation
+}
+_WORLD_TIMESERIES = {
+    (granularity, agg): _world_timeseries_stmt(granularity, agg)
+    for granularity in Granularity
+    for agg in Aggregation
+}
+_TYPE_TIMESERIES = {
+    granularity: _world_column_timeseries_stmt(
+        granularity, PlayerCountByWorld.type, "player_type"
+    )
+    for granularity in Granularity
+}
+_REGION_TIMESERIES = {
+    granularity: _world_column_timeseries_stmt(
+        granularity, PlayerCountByWorld.location, "region"
+    )
+    for granularity in Granularity
+}
+
+# Resolves the latest snapshot inside the same statement.
+_LATEST_SNAPSHOT = _snapshot_stmt(
+    select(func.max(PlayerCountByWorld.timestamp)).scalar_subquery()
+)
+_SNAPSHOT_AT = _snapshot_stmt(bindparam("timestamp"))
+
+_ACTIVITY_TOTALS = (
+    select(
+        PlayerCountByWorld.activity,
+        func.sum(PlayerCountByWorld.players).label("total_players"),
+        func.count(PlayerCountByWorld.id).label("snapshot_count"),
+    )
+    .filter(
+        PlayerCountByWorld.timestamp >= bindparam("start"),
+        PlayerCountByWorld.timestamp <= bindparam("end"),
+    )
+    .group_by(PlayerCountByWorld.activity)
+    .order_by(func.sum(PlayerCountByWorld.players).desc())
+)
+
+
+# ---------------------------------------------------------------------------
+# Query functions
+# ---------------------------------------------------------------------------
 
 
 def player_count_timeseries(
@@ -73,24 +253,14 @@ def player_count_timeseries(
     end: datetime,
     granularity: Granularity = Granularity.HOURLY,
     agg: Aggregation = Aggregation.AVERAGE,
+    yield_per: int | None = None,
 ):
     """Total player count over time for a single game (RS3 or OSRS)."""
-    bucket = _time_bucket(PlayerCount.timestamp, granularity)
-    agg_fn = _agg_func(agg)
-
-    return (
-        session.query(
-            bucket.label("time_bucket"),
-            agg_fn(PlayerCount.player_count).label("player_count"),
-        )
-        .filter(
-            PlayerCount.game == game,
-            PlayerCount.timestamp >= start,
-            PlayerCount.timestamp <= end,
-        )
-        .group_by(bucket)
-        .order_by(bucket)
-        .all()
+    return _execute(
+        session,
+        _GAME_TIMESERIES[granularity, agg],
+        {"game": game, "start": start, "end": end},
+        yield_per,
     )
 
 
@@ -100,23 +270,14 @@ def combined_total_timeseries(
     end: datetime,
     granularity: Granularity = Granularity.HOURLY,
     agg: Aggregation = Aggregation.AVERAGE,
+    yield_per: int | None = None,
 ):
     """Combined RS3 + OSRS player count over time."""
-    bucket = _time_bucket(PlayerCount.timestamp, granularity)
-    agg_fn = _agg_func(agg)
-
-    return (
-        session.query(
-            bucket.label("time_bucket"),
-            agg_fn(PlayerCount.player_count).label("player_count"),
-        )
-        .filter(
-            PlayerCount.timestamp >= start,
-            PlayerCount.timestamp <= end,
-        )
-        .group_by(bucket)
-        .order_by(bucket)
-        .all()
+    return _execute(
+        session,
+        _COMBINED_TIMESERIES[granularity, agg],
+        {"start": start, "end": end},
+        yield_per,
     )
 
 
@@ -126,26 +287,17 @@ def player_count_by_type(
     end: datetime,
     granularity: Granularity = Granularity.HOURLY,
     agg: Aggregation = Aggregation.AVERAGE,
+    yield_per: int | None = None,
 ):
     """F2P vs Members player count over time (from world data).
 
     Groups worlds by type within each time bucket, summing their players.
     """
-    bucket = _time_bucket(PlayerCountByWorld.timestamp, granularity)
-
-    return (
-        session.query(
-            bucket.label("time_bucket"),
-            PlayerCountByWorld.type.label("player_type"),
-            func.sum(PlayerCountByWorld.players).label("player_count"),
-        )
-        .filter(
-            PlayerCountByWorld.timestamp >= start,
-            PlayerCountByWorld.timestamp <= end,
-        )
-        .group_by(bucket, PlayerCountByWorld.type)
-        .order_by(bucket)
-        .all()
+    return _execute(
+        session,
+        _TYPE_TIMESERIES[granularity],
+        {"start": start, "end": end},
+        yield_per,
     )
 
 
@@ -155,23 +307,14 @@ def player_count_by_region(
     end: datetime,
     granularity: Granularity = Granularity.HOURLY,
     agg: Aggregation = Aggregation.AVERAGE,
+    yield_per: int | None = None,
 ):
     """Player count grouped by server region over time."""
-    bucket = _time_bucket(PlayerCountByWorld.timestamp, granularity)
-
-    return (
-        session.query(
-            bucket.label("time_bucket"),
-            PlayerCountByWorld.location.label("region"),
-            func.sum(PlayerCountByWorld.players).label("player_count"),
-        )
-        .filter(
-            PlayerCountByWorld.timestamp >= start,
-            PlayerCountByWorld.timestamp <= end,
-        )
-        .group_by(bucket, PlayerCountByWorld.location)
-        .order_by(bucket)
-        .all()
+    return _execute(
+        session,
+        _REGION_TIMESERIES[granularity],
+        {"start": start, "end": end},
+        yield_per,
     )
 
 
@@ -182,49 +325,22 @@ def player_count_by_world(
     end: datetime,
     granularity: Granularity = Granularity.HOURLY,
     agg: Aggregation = Aggregation.AVERAGE,
+    yield_per: int | None = None,
 ):
     """Player count for a specific world over time."""
-    bucket = _time_bucket(PlayerCountByWorld.timestamp, granularity)
-    agg_fn = _agg_func(agg)
-
-    return (
-        session.query(
-            bucket.label("time_bucket"),
-            agg_fn(PlayerCountByWorld.players).label("player_count"),
-        )
-        .filter(
-            PlayerCountByWorld.world == world,
-            PlayerCountByWorld.timestamp >= start,
-            PlayerCountByWorld.timestamp <= end,
-        )
-        .group_by(bucket)
-        .order_by(bucket)
-        .all()
+    return _execute(
+        session,
+        _WORLD_TIMESERIES[granularity, agg],
+        {"world": world, "start": start, "end": end},
+        yield_per,
     )
 
 
 def world_snapshot(session: Session, timestamp: datetime | None = None):
     """Per-world population at a specific point in time (default: latest)."""
     if timestamp is None:
-        timestamp = session.query(
-            func.max(PlayerCountByWorld.timestamp)
-        ).scalar()
-        if timestamp is None:
-            return []
-
-    return (
-        session.query(
-            PlayerCountByWorld.world,
-            PlayerCountByWorld.players,
-            PlayerCountByWorld.location,
-            PlayerCountByWorld.type,
-            PlayerCountByWorld.activity,
-            PlayerCountByWorld.timestamp,
-        )
-        .filter(PlayerCountByWorld.timestamp == timestamp)
-        .order_by(PlayerCountByWorld.players.desc())
-        .all()
-    )
+        return session.execute(_LATEST_SNAPSHOT)
+    return session.execute(_SNAPSHOT_AT, {"timestamp": timestamp})
 
 
 def player_count_by_activity(
@@ -233,17 +349,4 @@ def player_count_by_activity(
     end: datetime,
 ):
     """Total players grouped by world activity over a date range."""
-    return (
-        session.query(
-            PlayerCountByWorld.activity,
-            func.sum(PlayerCountByWorld.players).label("total_players"),
-            func.count(PlayerCountByWorld.id).label("snapshot_count"),
-        )
-        .filter(
-            PlayerCountByWorld.timestamp >= start,
-            PlayerCountByWorld.timestamp <= end,
-        )
-        .group_by(PlayerCountByWorld.activity)
-        .order_by(func.sum(PlayerCountByWorld.players).desc())
-        .all()
-    )
+    return session.execute(_ACTIVITY_TOTALS, {"start": start, "end": end})
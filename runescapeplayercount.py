@@ -5,19 +5,23 @@ RuneScape, as well as per-world population data for OSRS.  Results are
 stored in a SQLite database via SQLAlchemy for later analysis.
 """
 
+import asyncio
 import datetime
 import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 from io import StringIO
 
 import pandas as pd
 import requests
-from bs4 import BeautifulSoup
+from sqlalchemy import insert
 
 from models import (
     PlayerCount,
     PlayerCountByWorld,
+    five_minute_bucket,
     get_engine,
-    get_session,
     init_db,
 )
 
@@ -25,6 +29,12 @@ from models import (
 _http = requests.Session()
 _http.headers.update({"User-Agent": "Mozilla/5.0"})
 
+#Pages fetched within this many seconds are reused without a request.
+_PAGE_CACHE_TTL = 60
+
+#URL -> (fetched_at, ETag, Last-Modified, body) for conditional requests.
+_page_cache: dict[str, tuple[float, str | None, str | None, str]] = {}
+
 #Public endpoint that returns the current RS3 online player count.
 _RS3_PLAYER_COUNT_URL = (
     "https://www.runescape.com/c=JBGbhMzTjw4/player_count.js"
@@ -34,8 +44,20 @@ _RS3_PLAYER_COUNT_URL = (
 )
 
 
+#Extracts the count from the JSONP callback, e.g. ``jQuery...(123456)``.
+_RS3_PLAYER_COUNT_RE = re.compile(r"\((\d+)\)")
+
 _OSRS_WORLDS_URL = "https://oldschool.runescape.com/slu"
 
+#Matches the first number inside the world list's <p class="player-count">.
+_OSRS_PLAYER_COUNT_RE = re.compile(
+    r"""<p[^>]*\bclass=["'][^"']*\bplayer-count\b[^>]*>[^<\d]*([\d,]+)"""
+)
+
+#World list cells: the trailing world number and the player count.
+_WORLD_ID_RE = re.compile(r"(\d+)$")
+_PLAYERS_RE = re.compile(r"\d[\d,]*")
+
 
 def get_combined_player_count():
     """Return the combined RS3 + OSRS player count, or ``None`` on failure.
@@ -45,64 +67,136 @@ def get_combined_player_count():
     derive the true RS3-only figure.
     """
     resp = _http.get(_RS3_PLAYER_COUNT_URL, timeout=20)
-    match = re.search(r"\((\d+)\)", resp.text)
+    match = _RS3_PLAYER_COUNT_RE.search(resp.text)
     if match:
         return int(match.group(1))
     print("Could not find RS3 player count")
     return None
 
 
-def get_osrs_player_count():
+def _fetch_page(url):
+    """Return the body of *url*, reusing a cached copy where possible.
+
+    A copy younger than ``_PAGE_CACHE_TTL`` is returned as-is.  Older copies
+    are revalidated with ``If-None-Match`` / ``If-Modified-Since`` and reused
+    when the server answers ``304 Not Modified``.
+    """
+    now = time.monotonic()
+    cached = _page_cache.get(url)
+    if cached is not None and now - cached[0] < _PAGE_CACHE_TTL:
+        return cached[3]
+
+    headers = {}
+    if cached is not None:
+        _, etag, last_modified, _ = cached
+        if etag:
+            headers["If-None-Match"] = etag
+        if last_modified:
+            headers["If-Modified-Since"] = last_modified
+
+    resp = _http.get(url, headers=headers, timeout=20)
+    if resp.status_code == 304 and cached is not None:
+        #Unchanged: keep the cached body and its validators, refreshing any
+        #the server chose to resend.
+        _, etag, last_modified, body = cached
+        etag = resp.headers.get("ETag", etag)
+        last_modified = resp.headers.get("Last-Modified", last_modified)
+    else:
+        resp.raise_for_status()
+        body = resp.text
+        etag = resp.headers.get("ETag")
+        last_modified = resp.headers.get("Last-Modified")
+
+    _page_cache[url] = (now, etag, last_modified, body)
+    return body
+
+
+def _fetch_osrs_worlds_page():
+    """Return the HTML of the OSRS world list page."""
+    return _fetch_page(_OSRS_WORLDS_URL)
+
+
+def get_osrs_player_count(html=None):
     """Return the current OSRS online player count, or ``None`` on failure.
 
-    The count is scraped from the Old School RuneScape homepage.
+    The count is scraped from the OSRS world list page.  Pass *html* to
+    reuse a page already fetched for :func:`players_by_world`.
     """
-    resp = _http.get(_OSRS_WORLDS_URL, timeout=20)
-    soup = BeautifulSoup(resp.text, "html.parser")
-    tag = soup.find("p", class_="player-count")
-    if tag:
-        number = re.search(r"[\d,]+", tag.text).group().replace(",", "")
-        return int(number)
+    if html is None:
+        html = _fetch_osrs_worlds_page()
+    match = _OSRS_PLAYER_COUNT_RE.search(html)
+    if match:
+        return int(match.group(1).replace(",", ""))
     print("Could not find OSRS player count")
     return None
 
 
-def players_by_world():
-    """Return a DataFrame of OSRS world populations.
+def _parse_players(cell):
+    """Convert a world list cell such as ``"1,234 players"`` to an int."""
+    match = _PLAYERS_RE.search(cell)
+    return int(match.group().replace(",", "")) if match else 0
 
-    Columns: ``World``, ``Players``, ``Location``, ``Type``, ``Activity``.
-    Rows are sorted by player count in descending order.
-    """
-    resp = _http.get(_OSRS_WORLDS_URL, timeout=20)
-    resp.raise_for_status()
 
-    df = pd.read_html(StringIO(resp.text))[0]
+@lru_cache(maxsize=1)
+def _parse_world_table(html):
+    """Parse and clean the world table in *html*.
+
+    Memoized on the page body, so an unchanged page is only parsed once.
+    """
+    #Players (column 1) is parsed by a converter while the table is read,
+    #which skips type inference and a separate cleaning pass.
+    df = pd.read_html(
+        StringIO(html), flavor="lxml", converters={1: _parse_players}
+    )[0]
     df.columns = ["World", "Players", "Location", "Type", "Activity"]
 
-    df["World"] = df["World"].str.replace(r"^.*?(\d+)$", r"\1", regex=True)
-    df["Players"] = (
-        df["Players"]
-        .str.replace(" players", "")
-        .str.replace(",", "")
-        .fillna(0)
-        .astype(int)
-    )
-    df["Activity"] = (
-        df["Activity"].replace(["-", "", None], "No Activity").fillna("No Activity")
+    df["World"] = df["World"].str.extract(_WORLD_ID_RE, expand=False)
+    activity = df["Activity"]
+    df["Activity"] = activity.mask(
+        activity.isna() | activity.isin(["-", ""]), "No Activity"
     )
 
     return df.sort_values(by="Players", ascending=False).reset_index(drop=True)
 
 
+def players_by_world(html=None):
+    """Return a DataFrame of OSRS world populations.
+
+    Columns: ``World``, ``Players``, ``Location``, ``Type``, ``Activity``.
+    Rows are sorted by player count in descending order.  Pass *html* to
+    reuse an already fetched world list page.
+    """
+    if html is None:
+        html = _fetch_osrs_worlds_page()
+    #Copy so callers cannot mutate the memoized frame.
+    return _parse_world_table(html).copy()
+
+
+async def players_by_world_async(html=None):
+    """Async variant of :func:`players_by_world`.
+
+    Fetching and ``pd.read_html`` block for a noticeable time, so they run in
+    a worker thread to keep the event loop responsive.
+    """
+    return await asyncio.to_thread(players_by_world, html)
+
+
 def main():
     """Scrape player counts and save them to the database."""
     engine = get_engine()
     init_db(engine)
-    session = get_session(engine)
 
-    combined_count = get_combined_player_count()
-    osrs_count = get_osrs_player_count()
-    world_df = players_by_world()
+    #The two fetches are independent and network-bound, so run them
+    #concurrently; wall time is the slowest request rather than the sum.
+    #The OSRS count and world table both come from the same page.
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        combined_future = pool.submit(get_combined_player_count)
+        worlds_future = pool.submit(_fetch_osrs_worlds_page)
+        combined_count = combined_future.result()
+        worlds_html = worlds_future.result()
+
+    osrs_count = get_osrs_player_count(worlds_html)
+    world_df = players_by_world(worlds_html)
 
     #The official RS3 endpoint reports RS3 + OSRS combined.
     rs3_count = None
@@ -110,31 +204,25 @@ def main():
         rs3_count = combined_count - osrs_count
 
     timestamp = datetime.datetime.now()
-
-    if rs3_count is not None:
-        session.add(
-            PlayerCount(player_count=rs3_count, game="RS3", timestamp=timestamp)
-        )
-    if osrs_count is not None:
-        session.add(
-            PlayerCount(player_count=osrs_count, game="OSRS", timestamp=timestamp)
-        )
-
-    #Bulk-insert per-world records using to_dict for speed over iterrows.
-    session.add_all(
-        PlayerCountByWorld(
-            world=row["World"],
-            players=row["Players"],
-            location=row["Location"],
-            type=row["Type"],
-            activity=row["Activity"],
-            timestamp=timestamp,
-        )
-        for row in world_df.to_dict("records")
-    )
-
-    session.commit()
-    session.close()
+    bucket = five_minute_bucket(timestamp)
+
+    game_records = [
+        {"player_count": count, "game": game, "timestamp": timestamp, "bucket_5min": bucket}
+        for game, count in (("RS3", rs3_count), ("OSRS", osrs_count))
+        if count is not None
+    ]
+    world_records = [
+        {**row, "timestamp": timestamp, "bucket_5min": bucket}
+        for row in world_df.rename(columns=str.lower).to_dict("records")
+    ]
+
+    #Core executemany inserts in a single transaction: one commit for the
+    #whole scrape and no ORM unit-of-work bookkeeping.
+    with engine.begin() as conn:
+        if game_records:
+            conn.execute(insert(PlayerCount), game_records)
+        if world_records:
+            conn.execute(insert(PlayerCountByWorld), world_records)
 
     print(f"Combined (reported): {combined_count:,}" if combined_count else "Combined: N/A")
     print(f"RS3 Players Online:  {rs3_count:,}" if rs3_count is not None else "RS3: N/A")